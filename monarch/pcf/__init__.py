@@ -18,3 +18,7 @@
 # Number of times we should remove the iptables rule we added to block an app. This should be greater than one in case
 # you accidentally run this script to block it more than once before unblocking it.
 TIMES_TO_REMOVE = 6
+
+# Default number of bosh ssh sessions which may be open at once when fanning out commands to app instances. Can be
+# overridden with the `ssh-parallelism` config value.
+SSH_PARALLELISM = 16
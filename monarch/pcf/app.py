@@ -16,10 +16,14 @@
 """
 
 import json
+import logging
 import re
+import shlex
 import sys
-from random import shuffle
-from socket import gethostbyname
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from random import sample
+from urllib.parse import quote
 
 from logzero import logger
 
@@ -30,6 +34,9 @@ from monarch.pcf.app_instance import AppInstance
 from monarch.pcf.config import Config
 from monarch.pcf.service import Service
 
+# Matches the interface name in the first line of an `ip a` entry, e.g. '1234: s-010255178068@if1233: <...>'.
+_DIEGO_VI_RE = re.compile(r'\d+: ([\w-]+)(?:@[\w-]+)?:')
+
 
 class App:
     """
@@ -53,15 +60,24 @@ class App:
         if not app.find_guid():
             logger.error("App discovery failed because GUID could not be found!")
             return None
-        if not app.find_instances():
+
+        # these lookups are independent of each other and mostly spent waiting on the cf and bosh CLIs
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            instances = executor.submit(app.find_instances)
+            services = executor.submit(app.find_services)
+            instances = instances.result()
+            services = services.result()
+
+        if not instances:
             logger.error("App discovery failed because no application instances could be found!")
             return None
-        if app.find_services() is None:
+        if services is None:
             logger.error("App discovery failed because there was an error when finding services!")
             return None
 
         logger.info("Successfully discovered %s in %s %s.", appname, org, space)
-        logger.debug(json.dumps(app.serialize(), indent=2))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(app.serialize(), indent=2))
         return app
 
     def __init__(self, org, space, appname):
@@ -77,6 +93,8 @@ class App:
         self.guid = None
         self.services = []
         self.instances = []
+        self._services_by_name = {}
+        self._services_by_type = {}
 
     def __len__(self):
         """
@@ -101,6 +119,8 @@ class App:
         Will undo all manipulations first.
         """
         self.undo_all()
+        bosh.clear_apps_cache()
+        util.resolve_host.cache_clear()
         new_app = App.discover(self.org, self.space, self.name)
         self.__dict__ = new_app.__dict__
 
@@ -139,7 +159,7 @@ class App:
         the application which we can then use to find what containers are running it.
         :return: String; The application GUID.
         """
-        self.guid = find_application_guid(self.name)
+        self.guid = find_application_guid(self.name, org=self.org, space=self.space)
         return self.guid
 
     def find_instances(self):
@@ -156,6 +176,7 @@ class App:
         :return: Dict[String, Service]; The list of all services bound to this application.
         """
         self.services = find_application_services(self.name)
+        self._index_services()
         return self.services
 
     def find_routes(self):
@@ -173,6 +194,13 @@ class App:
         cfg = Config()
         if 'services' not in cfg:
             return self.services
+
+        # resolve the hosts concurrently up front so adding the services only hits the cache
+        hosts = {service['host'] for service in cfg['services']}
+        if hosts:
+            with ThreadPoolExecutor(max_workers=min(8, len(hosts))) as executor:
+                list(executor.map(util.resolve_host, hosts))
+
         for service in cfg['services']:
             self.add_custom_service(
                 service['name'],
@@ -195,24 +223,24 @@ class App:
         :param password: Optional[str]; Password the app uses to login.
         """
         hosts = []
-        addr = gethostbyname(host)
+        addr = util.resolve_host(host)
         for (protocol, port) in ports:
             hosts.append((addr, protocol, port))
 
-        self.services.append(Service(type='custom', name=name, user=user, password=password, hosts=hosts))
+        service = Service(type='custom', name=name, user=user, password=password, hosts=hosts)
+        self.services.append(service)
+        self._services_by_name.setdefault(name, service)
+        self._services_by_type.setdefault('custom', []).append(service)
 
     def crash_random_instance(self, count=1):
         """
         Crash one or more random application instances.
         :param count: int; Number of instances to crash.
         """
-        instances = self.instances.copy()
-        count = min(count, len(instances))
-        shuffle(instances)
-        instances = instances[:count]
-
-        for app_instance in instances:
-            app_instance.crash()
+        victims = sample(self.instances, min(count, len(self.instances)))
+        self._for_each_instance(lambda app_instance: app_instance.crash(), instances=victims)
+        # the crashed instances will be replaced, so the cached app instances are no longer accurate
+        bosh.clear_apps_cache()
 
     def block(self, direction='ingress', ports='env'):
         """
@@ -224,11 +252,13 @@ class App:
         certain ports; IF A CUSTOM LIST IS SPECIFIED, it must also be passed to unblocking.
         :return: int; A returncode if any of the bosh ssh instances do not return 0.
         """
-        for app_instance in self.instances:
-            rcode = app_instance.block(direction=direction, ports=ports)
-            if rcode:
-                self.unblock(ports=(ports if not isinstance(ports, str) else None))
-                return rcode
+        rcode = self._for_each_instance(
+            lambda app_instance: app_instance.block(direction=direction, ports=ports),
+            fail_fast=True
+        )
+        if rcode:
+            self.unblock(ports=(ports if not isinstance(ports, str) else None))
+            return rcode
         return 0
 
     def unblock(self, ports=None):
@@ -237,8 +267,7 @@ class App:
         times, as defined by `TIMES_TO_REMOVE` to prevent issues if an application was blocked multiple times.
         :param ports: set[int]; List of custom ports to unblock.
         """
-        for app_instance in self.instances:
-            app_instance.unblock(ports=ports)
+        self._for_each_instance(lambda app_instance: app_instance.unblock(ports=ports))
 
     def block_services(self, services=None, direction='egress'):
         """
@@ -247,42 +276,44 @@ class App:
         :param direction: str; Traffic direction to block.
         :return: int; A returncode if any of the bosh ssh instances do not return 0.
         """
-        cfg = Config()
+        targets = self._get_targeted_services(services)
         direction = util.parse_direction(direction)
         assert direction, "Could not parse direction!"
 
-        for app_instance in self.instances:
-            cmds = []
-            for service in self.services:
-                if service['type'] in cfg['service-whitelist']:
-                    continue
-                if services and service['name'] not in services:
-                    continue
-                logger.info("Blocking %s for %s:%s", service['name'], app_instance['diego_id'], app_instance['cont_ip'])
+        def instance_cmds(app_instance):
+            rules = []
+            cip = app_instance['cont_ip']
+            for service in targets:
+                logger.info("Blocking %s for %s:%s", service['name'], app_instance['diego_id'], cip)
                 for (sip, protocol, port) in service['hosts']:
                     if direction in {'egress', 'both'}:
-                        cmd = ['sudo', 'iptables', '-I', 'FORWARD', '1', '-s', app_instance['cont_ip'],
-                               '-d', sip, '-p', protocol]
-                        if port != 'all':
-                            cmd.extend(['--dport', port])
-                        cmd.extend(['-j', 'DROP'])
-                        cmds.append(' '.join(map(str, cmd)))
-
+                        rules.append('-I FORWARD 1 -s {} -d {} -p {}{} -j DROP'
+                                     .format(cip, sip, protocol, '' if port == 'all' else ' --dport {}'.format(port)))
                     if direction in {'ingress', 'both'}:
-                        cmd = ['sudo', 'iptables', '-I', 'FORWARD', '1', '-d', app_instance['cont_ip'],
-                               '-s', sip, '-p', protocol]
-                        if port != 'all':
-                            cmd.extend(['--sport', port])
-                        cmd.extend(['-j', 'DROP'])
-                        cmds.append(' '.join(map(str, cmd)))
-
-            if not cmds:
-                continue
-            rcode, _, _ = app_instance.run_cmd_on_diego_cell(cmds)
+                        rules.append('-I FORWARD 1 -d {} -s {} -p {}{} -j DROP'
+                                     .format(cip, sip, protocol, '' if port == 'all' else ' --sport {}'.format(port)))
+            if not rules:
+                return []
+            # apply all of the rules as one transaction instead of one iptables call per rule
+            return ['printf "%s\\n" {} | sudo iptables-restore --noflush'
+                    .format(' '.join(map(shlex.quote, ['*filter'] + rules + ['COMMIT'])))]
+
+        def block_cell_services(app_instances):
+            groups = [cmds for cmds in map(instance_cmds, app_instances) if cmds]
+            if not groups:
+                return 0
+            rcode, results = monarch.pcf.util.run_batched_on_diego_cell(app_instances[0]['diego_id'], groups)
+            rcode = rcode or next((r for (r, _) in results if r), 0)
             if rcode:
                 logger.error("Received return code %d from iptables call.", rcode)
-                self.unblock_services(services=services)
-                return rcode
+            return rcode
+
+        rcode = monarch.pcf.util.run_in_parallel(
+            block_cell_services, self.get_instances_by_diego_cell().values(), fail_fast=True
+        )
+        if rcode:
+            self.unblock_services(services=services)
+            return rcode
         return 0
 
     def unblock_services(self, services=None):
@@ -290,39 +321,36 @@ class App:
         Unblock this application from accessing its services on all its known hosts.
         :param services: List[String]; List of service names to unblock, will target all if unset.
         """
-        cfg = Config()
-        for app_instance in self.instances:
+        targets = self._get_targeted_services(services)
+        # Deleting with iptables-restore would be all or nothing, and the extra deletes are expected to fail once the
+        # rule is gone, so instead each rule is deleted in a loop on the diego cell which stops at the first failure.
+        remove_rule = 'for _ in $(seq {}); do sudo iptables -D FORWARD {{}} -j DROP || break; done' \
+            .format(TIMES_TO_REMOVE)
+
+        def instance_cmds(app_instance):
             cmds = []
-            for service in self.services:
-                if service['type'] in cfg['service-whitelist']:
-                    continue
-                if services and service['name'] not in services:
-                    continue
-                logger.info("Unblocking %s for %s:%s", service['name'], app_instance['diego_id'], app_instance['cont_ip'])
+            cip = app_instance['cont_ip']
+            for service in targets:
+                logger.info("Unblocking %s for %s:%s", service['name'], app_instance['diego_id'], cip)
                 for (sip, protocol, port) in service['hosts']:
-                    cmd = ['sudo', 'iptables', '-D', 'FORWARD', '-s', app_instance['cont_ip'],
-                           '-d', sip, '-p', protocol]
-                    if port != 'all':
-                        cmd.extend(['--dport', port])
-                    cmd.extend(['-j', 'DROP'])
-                    for _ in range(TIMES_TO_REMOVE):
-                        cmds.append(' '.join(map(str, cmd)))
-
-                    cmd = ['sudo', 'iptables', '-D', 'FORWARD', '-d', app_instance['cont_ip'],
-                           '-s', sip, '-p', protocol]
-                    if port != 'all':
-                        cmd.extend(['--sport', port])
-                    cmd.extend(['-j', 'DROP'])
-                    for _ in range(TIMES_TO_REMOVE):
-                        cmds.append(' '.join(map(str, cmd)))
+                    cmds.append(remove_rule.format('-s {} -d {} -p {}{}'.format(
+                        cip, sip, protocol, '' if port == 'all' else ' --dport {}'.format(port))))
+                    cmds.append(remove_rule.format('-d {} -s {} -p {}{}'.format(
+                        cip, sip, protocol, '' if port == 'all' else ' --sport {}'.format(port))))
+            return cmds
+
+        def unblock_cell_services(app_instances):
+            cmds = list(chain.from_iterable(map(instance_cmds, app_instances)))
             if not cmds:
-                continue
-            monarch.pcf.util.run_cmd_on_diego_cell(app_instance['diego_id'], cmds, suppress_output=True)
+                return
+            monarch.pcf.util.run_cmd_on_diego_cell(app_instances[0]['diego_id'], cmds, suppress_output=True)
             # if rcode:
             #     # This is normal because we remove the rule more than one time just in case.
             #     logger.warn("Received return code {} from iptables call.".format(rcode))
             #     code = rcode
 
+        monarch.pcf.util.run_in_parallel(unblock_cell_services, self.get_instances_by_diego_cell().values())
+
     def manipulate_network(self, **kwargs):
         """
         Manipulate the network traffic from the application and its services. This will not work simultaneously with
@@ -331,11 +359,13 @@ class App:
         :param kwargs: See `manipulate_network` in `AppInstance`.
         :return: int; A returncode if any of the bosh ssh instances do not return 0.
         """
-        for app_instance in self.instances:
-            rcode = app_instance.manipulate_network(**kwargs)
-            if rcode:
-                self.unmanipulate_network()
-                return rcode
+        rcode = self._for_each_instance(
+            lambda app_instance: app_instance.manipulate_network(**kwargs),
+            fail_fast=True
+        )
+        if rcode:
+            self.unmanipulate_network()
+            return rcode
         return 0
 
     def shape_network(self, download_limit=None, upload_limit=None):
@@ -353,19 +383,20 @@ class App:
         if not (download_limit or upload_limit):
             return 0  # noop
 
-        for app_instance in self.instances:
-            rcode = app_instance.shape_network(download_limit=download_limit, upload_limit=upload_limit)
-            if rcode:
-                self.unmanipulate_network()
-                return rcode
+        rcode = self._for_each_instance(
+            lambda app_instance: app_instance.shape_network(download_limit=download_limit, upload_limit=upload_limit),
+            fail_fast=True
+        )
+        if rcode:
+            self.unmanipulate_network()
+            return rcode
         return 0
 
     def unmanipulate_network(self):
         """
         Undo traffic manipulation changes to the application and its services.
         """
-        for app_instance in self.instances:
-            app_instance.unmanipulate_network()
+        self._for_each_instance(lambda app_instance: app_instance.unmanipulate_network())
 
     def kill_monit_process(self, process):
         """
@@ -374,35 +405,90 @@ class App:
         :param process: str; Name of the monit job to kill.
         :return: int; A returncode if any of the bosh ssh instances do not return 0.
         """
-        for app_instance in self.instances:
-            rcode, stdout, _ = app_instance.run_cmd_on_diego_cell(
-                'find /var/vcap/sys/run | grep {} | grep --color=never pid'.format(process)
+        quoted = shlex.quote(process)
+        # pid files are either in a directory named after the job or named after the process (bpm uses its own dir)
+        pid_globs = ' '.join(pattern.format(quoted) for pattern in [
+            '/var/vcap/sys/run/{}/*.pid', '/var/vcap/sys/run/*/{}.pid', '/var/vcap/sys/run/bpm/{}/*.pid'
+        ])
+
+        def kill_cell_monit_process(diego_id):
+            # discover the pid files and kill the processes in one ssh session, the kill is skipped remotely if no pid
+            # files were found
+            rcode, ((find_rcode, stdout), (kill_rcode, _)) = monarch.pcf.util.run_batched_on_diego_cell(
+                diego_id, [
+                    [
+                        "pid_files=$(shopt -s nullglob; printf '%s\\n' {} | sort -u)".format(pid_globs),
+                        'echo "$pid_files"'
+                    ], [
+                        'test -n "$pid_files" && sudo /var/vcap/bosh/bin/monit unmonitor {}'.format(quoted),
+                        'test -n "$pid_files" && sudo kill $(cat $pid_files)'
+                    ]
+                ]
             )
-            pid_files = list(filter(  # filter out garbage ssh lines
-                lambda l: ('/var/vcap/sys/run' in l) and ('find /var/vcap/sys/run' not in l),
-                stdout.splitlines()
-            ))
-            if rcode or not pid_files:
+            # only keep the listed files, not any ssh banner lines
+            pid_files = [l for l in stdout.splitlines() if l.startswith('/var/vcap/sys/run/')]
+            if rcode or find_rcode or not pid_files:
                 logger.error("Encountered error when discovering monit process.")
-                return rcode
-            logger.debug("Found pid files %s for %s on %s.", pid_files, process, app_instance['diego_id'])
+                return rcode or find_rcode
+            logger.debug("Found pid files %s for %s on %s.", pid_files, process, diego_id)
 
-            cmds = ['sudo /var/vcap/bosh/bin/monit unmonitor {}'.format(process)]
-            cmds.extend(['sudo kill $(cat {})'.format(pf) for pf in pid_files])
-            rcode, _, _ = app_instance.run_cmd_on_diego_cell(cmds)
-            if rcode:
+            if kill_rcode:
                 logger.error("Encountered error killing monit processes!")
-                self.start_monit_process(process)
-                return rcode
-            return 0
+            return kill_rcode
+
+        # monit jobs belong to the diego cell, not the app instance, so only kill them once per cell
+        rcode = monarch.pcf.util.run_in_parallel(
+            kill_cell_monit_process, self.get_instances_by_diego_cell().keys(), fail_fast=True
+        )
+        if rcode:
+            self.start_monit_process(process)
+            return rcode
+        return 0
 
     def start_monit_process(self, process):
         """
         Start a monit process on all diego cells this application is hosted on.
         :param process: str; Name of the monit job to kill.
         """
-        for app_instance in self.instances:
-            app_instance.run_cmd_on_diego_cell('sudo /var/vcap/bosh/bin/monit start {}'.format(process))
+        cmd = 'sudo /var/vcap/bosh/bin/monit start {}'.format(shlex.quote(process))
+        monarch.pcf.util.run_in_parallel(
+            lambda diego_id: monarch.pcf.util.run_cmd_on_diego_cell(diego_id, cmd)[0],
+            self.get_instances_by_diego_cell().keys()
+        )
+
+    def get_instances_by_diego_cell(self, instances=None):
+        """
+        Group the application instances by the diego cell which hosts them.
+        :param instances: Optional[List[AppInstance]]; Subset of the app instances to group, defaults to all of them.
+        :return: Dict[str, List[AppInstance]]; The app instances keyed by their diego cell ID.
+        """
+        cells = {}
+        for app_instance in (self.instances if instances is None else instances):
+            cells.setdefault(app_instance['diego_id'], []).append(app_instance)
+        return cells
+
+    def _for_each_instance(self, func, fail_fast=False, instances=None):
+        """
+        Call a function on every application instance. Diego cells are handled concurrently, but the instances sharing
+        a diego cell are handled one after another so their iptables and tc changes do not contend with each other.
+        :param func: Callable[[AppInstance], Optional[int]]; Function to call, it should return a returncode.
+        :param fail_fast: bool; If true, stop calling the function after the first non-zero returncode.
+        :param instances: Optional[List[AppInstance]]; Subset of the app instances to call it on, defaults to all.
+        :return: int; The first non-zero returncode received or 0 if all calls succeeded.
+        """
+        def run_on_cell(app_instances):
+            rcode = 0
+            for app_instance in app_instances:
+                res = func(app_instance)
+                if res and not rcode:
+                    rcode = res
+                    if fail_fast:
+                        break
+            return rcode
+
+        return monarch.pcf.util.run_in_parallel(
+            run_on_cell, self.get_instances_by_diego_cell(instances).values(), fail_fast=fail_fast
+        )
 
     def get_services_by_type(self, service_type):
         """
@@ -410,7 +496,7 @@ class App:
         :param service_type: String; The type of service to filter by.
         :return: List[String]; A list of services of the specified type.
         """
-        return [s for s in self.services if s.type == service_type]
+        return list(self._services_by_type.get(service_type, []))
 
     def get_service_by_name(self, service_name):
         """
@@ -419,28 +505,72 @@ class App:
         :param service_name: String; The name of the bound service.
         :return: Optional[Service]; The service or None if there was no match.
         """
-        for service in self.services:
-            if service['name'] == service_name:
-                return service
+        return self._services_by_name.get(service_name)
 
-        return None
+    def _get_targeted_services(self, services=None):
+        """
+        Find the services which blocking or unblocking services should act on.
+        :param services: Optional[List[String]]; List of service names to target, will target all if unset.
+        :return: List[Service]; The services which are not whitelisted and match the requested names.
+        """
+        whitelist = frozenset(Config()['service-whitelist'])
+        names = frozenset(services) if services else None
+        return [s for s in self.services if s['type'] not in whitelist and (names is None or s['name'] in names)]
+
+    def _index_services(self):
+        """
+        Rebuild the lookup tables used to find services by name and type.
+        """
+        self._services_by_name = {}
+        self._services_by_type = {}
+        for service in self.services:
+            self._services_by_name.setdefault(service['name'], service)
+            self._services_by_type.setdefault(service['type'], []).append(service)
 
 
-def find_application_guid(appname):
+def find_application_guid(appname, org, space):
     """
-    Find the GUID of an application using cloud foundry's CLI interface. The GUID acts as a unique identifier for
-    the application which we can then use to find what containers are running it.
+    Find the GUID of an application using cloud foundry's API. The GUID acts as a unique identifier for the
+    application which we can then use to find what containers are running it. This uses `cf curl` rather than
+    `cf app --guid` since the latter is significantly slower. Unlike `cf app`, the API is not limited to the targeted
+    space, so the organization and space must be given.
     :param appname: String; The name of the app to deserialize.
+    :param org: String; The organization the app is in.
+    :param space: String; The organization space the app is in.
     :return: String; The application GUID.
     """
-    assert appname
+    assert appname and org and space
     cfg = Config()
-    cmd = '{} app {} --guid'.format(cfg['cf']['cmd'], appname)
-    rcode, stdout, _ = util.run_cmd(cmd)
-    guid = stdout.splitlines()[0]
+    rcode, stdout, _ = util.run_cmd([
+        cfg['cf']['cmd'], 'curl',
+        "'/v3/apps?names={}&include=space.organization'".format(quote(appname))
+    ])
     if rcode:
-        sys.exit("Failed retrieving the GUID for the specified app. Make sure {} is in this space!".format(appname))
+        sys.exit("Failure to call cf curl!")
+
+    error_msg = "Failed retrieving the GUID for the specified app. Make sure {} is in this space!".format(appname)
+    # cf curl exits with 0 on API errors, those responses have `errors` instead of `resources`
+    response = next(util.iter_json(stdout), None)
+    if not response or 'resources' not in response:
+        logger.error("Unexpected response from cloud foundry: %s", stdout)
+        sys.exit(error_msg)
+
+    included = response.get('included', {})
+    spaces = {s['guid']: s for s in included.get('spaces', [])}
+    orgs = {o['guid']: o['name'] for o in included.get('organizations', [])}
+
+    guids = []
+    for resource in response['resources']:
+        app_space = spaces.get(resource['relationships']['space']['data']['guid'])
+        if not app_space or app_space['name'] != space:
+            continue
+        if orgs.get(app_space['relationships']['organization']['data']['guid']) != org:
+            continue
+        guids.append(resource['guid'])
+    if len(guids) != 1:
+        sys.exit(error_msg)
 
+    guid = guids[0]
     logger.debug(guid)
     return guid
 
@@ -455,24 +585,27 @@ def find_application_routes(app_guid):
     cfg = Config()
     routes = []
 
+    # inline the domains so we do not need to make an extra call for each route
     rcode, stdout, _ = util.run_cmd([
         cfg['cf']['cmd'], 'curl',
-        '/v2/apps/{}/routes'.format(app_guid)
+        "'/v2/apps/{}/routes?inline-relations-depth=1'".format(app_guid)
     ])
     if rcode:
         sys.exit("Failure to call cf curl!")
 
+    response = next(util.iter_json(stdout), None)
+    if not response or 'resources' not in response:
+        logger.error("Unexpected response from cloud foundry: %s", stdout)
+        sys.exit("Failure to call cf curl!")
+
     resources = map(
         lambda v: v['entity'],
-        util.extract_json(stdout)[0]['resources']
+        response['resources']
     )
     for resource in resources:
         host = resource['host']
         path = resource['path']
-        rcode, stdout, _ = util.run_cmd([cfg['cf']['cmd'], 'curl', resource['domain_url']])
-        if rcode:
-            sys.exit("Failure to call cf curl!")
-        domain = util.extract_json(stdout)[0]['entity']['name']
+        domain = resource['domain']['entity']['name']
         route = '{}.{}'.format(host, domain)
         if path and path != '':
             route += '/{}'.format(path)
@@ -486,16 +619,16 @@ def find_application_instances(app_guid):
     :return: List[AppInstance]; The app instances app and their associated hosts.
     """
     cfg = Config()
+    host_port_whitelist = frozenset(cfg['host-port-whitelist'])
+    cont_port_whitelist = frozenset(cfg['container-port-whitelist'])
 
     # for each instance, find information about where it is hosted and its connected ports
     instances = []
-    raw_apps = bosh.get_apps()
+    raw_apps = bosh.get_apps_by_guid()
     if not raw_apps:
         logger.warning("No application instances found for %s.", app_guid)
         return None
-    for instance in raw_apps:
-        if instance['app_guid'] != app_guid:
-            continue
+    for instance in raw_apps.get(app_guid, []):
         if instance['state'] != 'RUNNING':
             continue
         diego_ip = instance['address']
@@ -507,8 +640,8 @@ def find_application_instances(app_guid):
             diego_port = ports['host_port']  # node port on the diego-cell
             cont_port = ports['container_port']  # port the application is listening on in the container
 
-            add_diego_port = diego_port not in cfg['host-port-whitelist']
-            add_cont_port = cont_port not in cfg['container-port-whitelist']
+            add_diego_port = diego_port not in host_port_whitelist
+            add_cont_port = cont_port not in cont_port_whitelist
             if add_diego_port and add_cont_port:
                 app_ports.add((diego_port, cont_port))
                 logger.debug('Found application at %s:%d with container port %d', diego_ip, diego_port, cont_port)
@@ -516,8 +649,8 @@ def find_application_instances(app_guid):
             diego_tls_port = ports.get('host_tls_proxy_port')
             cont_tls_port = ports.get('container_tls_proxy_port')
 
-            add_diego_tls_port = diego_tls_port is not None and diego_tls_port not in cfg['host-port-whitelist']
-            add_cont_tls_port = cont_tls_port is not None and cont_tls_port not in cfg['container-port-whitelist']
+            add_diego_tls_port = diego_tls_port is not None and diego_tls_port not in host_port_whitelist
+            add_cont_tls_port = cont_tls_port is not None and cont_tls_port not in cont_port_whitelist
             if add_diego_tls_port and add_cont_tls_port:
                 app_ports.add((diego_tls_port, cont_tls_port))
                 logger.debug('Found application at %s:%d with tls container port %d', diego_ip, diego_tls_port, cont_tls_port)
@@ -531,7 +664,7 @@ def find_application_instances(app_guid):
             diego_vi = None
         else:
             diego_vi = stdout[index[0]][0]  # want to get parent of the match
-            match = re.match(r'\d+: ([\w-]+)(@[\w-]+)?:', diego_vi)
+            match = _DIEGO_VI_RE.match(diego_vi)
             assert match  # This should never fail, so the regex must be wrong!
             diego_vi = match[1]
             logger.debug("Hosting diego-cell Virtual Interface: %s", diego_vi)
@@ -539,11 +672,12 @@ def find_application_instances(app_guid):
         # Lookup the Container ID
         cmd = "sudo cat /var/vcap/sys/log/rep/rep.stdout.log | grep {} | tail -n 1".format(cont_ip)
         rcode, stdout, _ = monarch.pcf.util.run_cmd_on_diego_cell(diego_id, cmd)
-        if rcode:
+        log_entry = None if rcode else next(util.iter_json(stdout), None)
+        if not log_entry:
             logger.error("Failed retrieving container GUID from %s.", diego_id)
             cont_id = None
         else:
-            cont_id = util.extract_json(stdout)[0]['data']['container-guid']
+            cont_id = log_entry['data']['container-guid']
             logger.debug("Hosting container GUID: %s.", cont_id)
 
         # Record the app instance information
@@ -571,21 +705,20 @@ def find_application_services(appname):
     if rcode:
         sys.exit("Failed to query application environment variables.")
 
-    json_objs = util.extract_json(stdout)
-    if not json_objs:
+    json_objs = util.iter_json(stdout)
+    first = next(json_objs, None)
+    if first is None:
         sys.exit("Error reading output from `cf env`")
 
-    for obj in json_objs:
-        if 'VCAP_SERVICES' not in obj:
-            json_objs.remove(obj)
-
-    if len(json_objs) != 1:
+    system_env = next((obj for obj in chain([first], json_objs) if 'VCAP_SERVICES' in obj), None)
+    if system_env is None:
         logger.info("No services found for %s.", appname)
         return []
 
     services = []
-    vservices = json_objs[0]['VCAP_SERVICES']
-    logger.debug(json.dumps(vservices, indent='  '))
+    vservices = system_env['VCAP_SERVICES']
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(vservices, indent='  '))
 
     for sname, sconfig in vservices.items():
         for instance_cfg in sconfig:
@@ -16,6 +16,8 @@
 """
 
 import json
+import time
+from threading import Lock
 
 from logzero import logger
 
@@ -24,6 +26,13 @@ from monarch import util
 from monarch.pcf.config import Config
 from monarch.util import filter_map
 
+# Default number of seconds the indexed `get_apps` results are reused for. Can be overridden with the `bosh-cache-ttl`
+# config value. Disabled by default since app instances move around as soon as they are crashed or restarted.
+APPS_CACHE_TTL = 0
+
+_apps_cache = {'time': None, 'apps': None}
+_apps_cache_lock = Lock()
+
 
 def get_vms(env=None, dep=None):
     """
@@ -106,13 +115,45 @@ def get_apps():
         logger.error("Failed retrieving actual LRP grups from %s", cfg['bosh']['cfdot-dc'])
         return None
     apps = []
-    for app in util.extract_json(stdout):
+    for app in util.iter_json(stdout):
         app = app['instance']
         app['app_guid'] = app['process_guid'][:36]
         apps.append(app)
     return apps
 
 
+def get_apps_by_guid():
+    """
+    Get the apps deployed in the cloud foundry cluster indexed by their app GUID. The index is cached for a short time
+    so that discovering several applications only needs to query cfdot once.
+    :return: Optional[Dict[str, List[Dict]]]; The app instances keyed by app GUID. See `get_apps` for the format.
+    """
+    ttl = Config().get('bosh-cache-ttl', APPS_CACHE_TTL)
+    with _apps_cache_lock:
+        now = time.monotonic()
+        if _apps_cache['time'] is not None and now - _apps_cache['time'] < ttl:
+            return _apps_cache['apps']
+
+        apps = get_apps()
+        if apps is None:
+            return None
+        index = {}
+        for app in apps:
+            index.setdefault(app['app_guid'], []).append(app)
+        _apps_cache['time'] = now
+        _apps_cache['apps'] = index
+        return index
+
+
+def clear_apps_cache():
+    """
+    Forget the cached results of `get_apps_by_guid`, use this when the app instances are known to have changed.
+    """
+    with _apps_cache_lock:
+        _apps_cache['time'] = None
+        _apps_cache['apps'] = None
+
+
 def get_apps_in_diego_cell(diego_cell):
     """
     Get a list of all applications hosted on a specific diego-cell.
@@ -14,8 +14,11 @@
 
 """ PCF util functions.
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tempfile import NamedTemporaryFile
+from uuid import uuid4
 
+from monarch.pcf import SSH_PARALLELISM
 from monarch.pcf.config import Config
 from monarch.util import run_cmd
 
@@ -59,6 +62,43 @@ def run_cmd_on_diego_cell(dcid, cmd, suppress_output=False):
     return bosh_cli(['ssh', dcid], cmd, suppress_output=suppress_output)
 
 
+def run_batched_on_diego_cell(dcid, command_groups, suppress_output=False):
+    """
+    Run several groups of commands on a diego cell using a single ssh session. A separator line carrying the
+    returncode of each group is echoed after it so the output can be split back up locally.
+    :param dcid: str; Diego-cell ID of the Diego Cell which is to be connected to.
+    :param command_groups: List[Union[str, List[str]]]; Groups of command(s) to run on the Diego Cell in order.
+    :param suppress_output: bool; If true, no extra debug output will be printed when an error occurs.
+    :return: int, List[(int, str)]; Returncode of the ssh session and the (returncode, stdout) of each group. Groups
+    which did not report back are given a non-zero returncode.
+    """
+    sep = '__MONARCH_SEP_{}__'.format(uuid4().hex)
+    # split the separator in the echo so that an echoed command line can not be mistaken for it
+    sep_cmd = 'echo "{}""{} $?"'.format(sep[:8], sep[8:])
+
+    cmds = []
+    for group in command_groups:
+        cmds.extend(group if isinstance(group, list) else [group])
+        cmds.append(sep_cmd)
+    rcode, stdout, _ = run_cmd_on_diego_cell(dcid, cmds, suppress_output=suppress_output)
+
+    results = []
+    lines = []
+    for line in stdout.splitlines():
+        index = line.find(sep)
+        if index < 0:
+            lines.append(line)
+            continue
+        group_rcode = line[index + len(sep):].strip()
+        results.append((int(group_rcode) if group_rcode.isdigit() else 1, '\n'.join(lines)))
+        lines = []
+
+    while len(results) < len(command_groups):
+        results.append((rcode or 1, '\n'.join(lines)))
+        lines = []
+    return rcode, results
+
+
 def run_cmd_on_container(dcid, contid, cmd, suppress_output=False):
     """
     Run one or more commands in the shell on a container on a diego cell.
@@ -76,6 +116,35 @@ def run_cmd_on_container(dcid, contid, cmd, suppress_output=False):
     return run_cmd_on_diego_cell(dcid, cmd, suppress_output=suppress_output)
 
 
+def run_in_parallel(func, items, fail_fast=False):
+    """
+    Call a function once for each item using a thread pool. This is meant for fanning out bosh ssh calls to multiple
+    hosts since they spend nearly all of their time waiting on the network.
+    :param func: Callable[[any], Optional[int]]; Function to call for each item. It should return a returncode.
+    :param items: Iterable[any]; Items to call the function with.
+    :param fail_fast: bool; If true, calls which have not started yet will be cancelled after the first failure.
+    :return: int; The first non-zero returncode received or 0 if all calls succeeded.
+    """
+    items = list(items)
+    if not items:
+        return 0
+
+    workers = min(len(items), Config().get('ssh-parallelism', SSH_PARALLELISM))
+    rcode = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            res = future.result()
+            if res and not rcode:
+                rcode = res
+                if fail_fast:
+                    for pending in futures:
+                        pending.cancel()
+    return rcode
+
+
 def cf_target(org, space):
     """
     Target a specific organization and space using the cloud foundry CLI. This should be run before anything which calls
@@ -18,6 +18,7 @@
 import json
 import re
 import time
+from functools import lru_cache
 from statistics import median, variance, mean
 from subprocess import Popen, PIPE
 from logzero import logger
@@ -68,6 +69,16 @@ def run_cmd(cmd, stdin=None, suppress_output=False, timeout=30):
     return rcode, stdout, stderr
 
 
+@lru_cache(maxsize=256)
+def resolve_host(host):
+    """
+    Resolve a hostname to its IPv4 address. Results are cached since the same hosts tend to be looked up repeatedly.
+    :param host: str; Hostname or IP address to resolve.
+    :return: str; The IPv4 address of the host.
+    """
+    return gethostbyname(host)
+
+
 def ping(url, count=5, interval=200, size=None):
     """
     Ping a remote host. (Unix support only!)
@@ -125,39 +136,55 @@ def curl_ping(url, count=5):
     return stats
 
 
-def extract_json(string):
+def iter_json(string):
     """
-    Extract JSON from a string by scanning for the start `{` and end `}`. It will extract this from a string and then
-    load it as a JSON object. If multiple json objects are detected, it will create a list of them. If no JSON is found,
-    then None will be returned.
+    Lazily extract JSON objects from a string. Each top level `{` is tried as the start of a JSON object; if it does
+    not parse, everything up to its matching `}` is skipped so none of its nested objects are returned. Only as much of
+    the string is decoded as the caller consumes.
     :param string: String; String possibly containing one or more JSON objects.
-    :return: Optional[list[dict[String, any]]]; A list of JSON objects or None.
+    :return: Iterator[dict[String, any]]; The JSON objects in the order they appear.
+    """
+    decoder = json.JSONDecoder()
+    index = string.find('{')
+    while index >= 0:
+        try:
+            obj, end = decoder.raw_decode(string, index)
+        except json.JSONDecodeError:
+            # ignore it and move on
+            end = _find_closing_brace(string, index)
+            if end is None:
+                return
+        else:
+            yield obj
+        index = string.find('{', end)
+
+
+def _find_closing_brace(string, start):
+    """
+    Find the `}` which closes the `{` at `start` by counting braces.
+    :return: Optional[int]; Index just past the closing brace or None if it is never closed.
     """
     depth = 0
-    obj_strs = []
-    for index, char in enumerate(string):
+    for index in range(start, len(string)):
+        char = string[index]
         if char == '{':
             depth += 1
-
-            if depth == 1:
-                start = index
-        elif char == '}' and depth > 0:
+        elif char == '}':
             depth -= 1
-
             if depth == 0:
-                obj_strs.append(string[start:index + 1])
+                return index + 1
+    return None
 
-    if not obj_strs:
-        return None
 
-    objs = []
-    for obj_str in obj_strs:
-        try:
-            objs.append(json.loads(obj_str))
-        except json.JSONDecodeError:
-            # ignore it and move on
-            pass
-    return objs
+def extract_json(string):
+    """
+    Extract JSON from a string by scanning for the start `{` and end `}`. It will extract this from a string and then
+    load it as a JSON object. If multiple json objects are detected, it will create a list of them. If no JSON is found,
+    then None will be returned. See also `iter_json`.
+    :param string: String; String possibly containing one or more JSON objects.
+    :return: Optional[list[dict[String, any]]]; A list of JSON objects or None.
+    """
+    return list(iter_json(string)) or None
 
 
 def group_lines_by_hanging_indent(lines, mode='group'):
@@ -259,13 +286,15 @@ def find_string_in_grouping(groups, pattern):
     """
     Searches for a string in an array structure of strings. Performs DFS.
     :param groups: Strings grouped by arrays with no bound on subgroups.
-    :param pattern: str; The key string to search for; it is a regex search.
+    :param pattern: Union[str, Pattern]; The key string to search for; it is a regex search.
     :return: list[int]; Full index of the first match.
     """
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern)
     for (index, value) in enumerate(groups):
         assert isinstance(value, (list, str))
         if isinstance(value, str):
-            if re.search(pattern, value):
+            if pattern.search(value):
                 return [index]
         else:
             submatch = find_string_in_grouping(value, pattern)
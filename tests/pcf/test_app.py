@@ -68,7 +68,7 @@ def url():
             assert_cmd([cfg['cf']['cmd'], 'restage', depcfg['appname']], timeout=60*5)
             os.chdir(start_dir)
 
-    routes = find_application_routes(find_application_guid(depcfg['appname']))
+    routes = find_application_routes(find_application_guid(depcfg['appname'], depcfg['org'], depcfg['space']))
     url = routes[0]
     yield url
 
@@ -0,0 +1,98 @@
+# Copyright 2019 T-Mobile US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import pytest
+
+import monarch.pcf.app
+from monarch.pcf.app import find_application_guid
+from monarch.pcf.config import Config
+
+
+def app_resource(guid, space_guid):
+    return {'guid': guid, 'relationships': {'space': {'data': {'guid': space_guid}}}}
+
+
+def space_resource(guid, name, org_guid):
+    return {'guid': guid, 'name': name, 'relationships': {'organization': {'data': {'guid': org_guid}}}}
+
+
+APPS_RESPONSE = {
+    'resources': [
+        app_resource('guid-dev', 'space-dev'),
+        app_resource('guid-prod', 'space-prod'),
+        app_resource('guid-other-org', 'space-other-dev'),
+        app_resource('guid-unknown-space', 'space-missing')
+    ],
+    'included': {
+        'spaces': [
+            space_resource('space-dev', 'dev', 'org-1'),
+            space_resource('space-prod', 'prod', 'org-1'),
+            space_resource('space-other-dev', 'dev', 'org-2')
+        ],
+        'organizations': [
+            {'guid': 'org-1', 'name': 'myorg'},
+            {'guid': 'org-2', 'name': 'otherorg'}
+        ]
+    }
+}
+
+
+@pytest.fixture
+def cf_curl(monkeypatch):
+    monkeypatch.setitem(Config(), 'cf', {'cmd': 'cf'})
+    calls = []
+
+    def respond(output, rcode=0):
+        def run_cmd(cmd):
+            calls.append(cmd)
+            return rcode, output if isinstance(output, str) else json.dumps(output), ''
+        monkeypatch.setattr(monarch.pcf.app.util, 'run_cmd', run_cmd)
+        return calls
+
+    return respond
+
+
+def test_find_application_guid(cf_curl):
+    calls = cf_curl('Some cf output\n' + json.dumps(APPS_RESPONSE))
+    assert find_application_guid('my app', 'myorg', 'dev') == 'guid-dev'
+    assert find_application_guid('my app', 'myorg', 'prod') == 'guid-prod'
+    assert find_application_guid('my app', 'otherorg', 'dev') == 'guid-other-org'
+    assert calls[0] == ['cf', 'curl', "'/v3/apps?names=my%20app&include=space.organization'"]
+
+
+@pytest.mark.parametrize('org, space', [('myorg', 'test'), ('nope', 'dev')])
+def test_find_application_guid_no_match(cf_curl, org, space):
+    cf_curl(APPS_RESPONSE)
+    with pytest.raises(SystemExit):
+        find_application_guid('my app', org, space)
+
+
+def test_find_application_guid_multiple_matches(cf_curl):
+    response = json.loads(json.dumps(APPS_RESPONSE))
+    response['resources'].append(app_resource('guid-dev-2', 'space-dev'))
+    cf_curl(response)
+    with pytest.raises(SystemExit):
+        find_application_guid('my app', 'myorg', 'dev')
+
+
+@pytest.mark.parametrize('output, rcode', [
+    ({'errors': [{'code': 1000, 'title': 'CF-InvalidAuthToken'}]}, 0),
+    ('no json at all', 0),
+    ('', 1)
+])
+def test_find_application_guid_errors(cf_curl, output, rcode):
+    cf_curl(output, rcode)
+    with pytest.raises(SystemExit):
+        find_application_guid('my app', 'myorg', 'dev')
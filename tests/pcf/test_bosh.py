@@ -0,0 +1,59 @@
+# Copyright 2019 T-Mobile US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+from monarch.pcf import bosh
+from monarch.pcf.config import Config
+
+
+@pytest.fixture
+def fake_apps(monkeypatch):
+    calls = []
+
+    def get_apps():
+        calls.append(None)
+        return [
+            {'app_guid': 'a', 'index': 0},
+            {'app_guid': 'b', 'index': 0},
+            {'app_guid': 'a', 'index': 1}
+        ]
+
+    monkeypatch.setattr(bosh, 'get_apps', get_apps)
+    bosh.clear_apps_cache()
+    yield calls
+    bosh.clear_apps_cache()
+
+
+def test_get_apps_by_guid(fake_apps):
+    apps = bosh.get_apps_by_guid()
+    assert [i['index'] for i in apps['a']] == [0, 1]
+    assert [i['index'] for i in apps['b']] == [0]
+
+
+def test_get_apps_by_guid_not_cached_by_default(fake_apps, monkeypatch):
+    monkeypatch.delitem(Config(), 'bosh-cache-ttl', raising=False)
+    bosh.get_apps_by_guid()
+    bosh.get_apps_by_guid()
+    assert len(fake_apps) == 2
+
+
+def test_get_apps_by_guid_cache(fake_apps, monkeypatch):
+    monkeypatch.setitem(Config(), 'bosh-cache-ttl', 60)
+    first = bosh.get_apps_by_guid()
+    assert bosh.get_apps_by_guid() is first
+    assert len(fake_apps) == 1
+
+    bosh.clear_apps_cache()
+    assert bosh.get_apps_by_guid() is not first
+    assert len(fake_apps) == 2
@@ -0,0 +1,98 @@
+# Copyright 2019 T-Mobile US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import time
+
+import monarch.pcf.util
+from monarch.pcf.app import App
+from monarch.pcf.app_instance import AppInstance
+from monarch.pcf.config import Config
+from monarch.pcf.util import run_batched_on_diego_cell, run_in_parallel
+from monarch.util import run_cmd
+
+
+def local_shell(dcid, cmd, suppress_output=False):
+    """Run the commands in a local shell which echoes each command line into stdout like a noisy ssh session might."""
+    return run_cmd('bash -v 2>&1', stdin=cmd, suppress_output=suppress_output)
+
+
+def test_run_batched_on_diego_cell(monkeypatch):
+    monkeypatch.setattr(monarch.pcf.util, 'run_cmd_on_diego_cell', local_shell)
+    rcode, results = run_batched_on_diego_cell('diego_cell/0', [
+        ['x=$(echo hello)', 'echo "$x"'],
+        'false',
+        ['echo a', 'echo b']
+    ])
+    assert rcode == 0
+    assert len(results) == 3
+    assert results[0][0] == 0
+    assert 'hello' in results[0][1].splitlines()
+    assert results[1][0] == 1
+    assert results[2][0] == 0
+    # the echoed separator command is plain output, only the line it prints splits the groups
+    lines = results[2][1].splitlines()
+    assert lines[:4] == ['echo a', 'a', 'echo b', 'b']
+    assert len(lines) == 5 and lines[4].startswith('echo "__MONARC""H_SEP_')
+
+
+def test_run_batched_on_diego_cell_bad_rcode(monkeypatch):
+    def fake(dcid, cmd, suppress_output=False):
+        sep = re.search(r'echo "(\w+)""(\w+) \$\?"', cmd[-1])
+        return 0, 'out\n{}{} oops\n'.format(sep[1], sep[2]), ''
+
+    monkeypatch.setattr(monarch.pcf.util, 'run_cmd_on_diego_cell', fake)
+    assert run_batched_on_diego_cell('diego_cell/0', ['echo out']) == (0, [(1, 'out')])
+
+
+def test_run_batched_on_diego_cell_pads_missing_groups(monkeypatch):
+    monkeypatch.setattr(monarch.pcf.util, 'run_cmd_on_diego_cell', lambda *args, **kwargs: (255, 'banner', ''))
+    rcode, results = run_batched_on_diego_cell('diego_cell/0', ['echo a', 'echo b'])
+    assert rcode == 255
+    assert results == [(255, 'banner'), (255, '')]
+
+
+def test_kill_monit_process_ssh_failure(monkeypatch):
+    monkeypatch.setattr(monarch.pcf.util, 'run_cmd_on_diego_cell', lambda *args, **kwargs: (255, '', ''))
+    app = App('org', 'space', 'app')
+    app.instances = [AppInstance(diego_id='diego_cell/0'), AppInstance(diego_id='diego_cell/0')]
+    assert app.kill_monit_process('rep') == 255
+
+
+def test_run_in_parallel():
+    assert run_in_parallel(lambda i: 0, []) == 0
+    assert run_in_parallel(lambda i: 0, range(10)) == 0
+    assert run_in_parallel(lambda i: 3 if i == 5 else None, range(10)) == 3
+
+    calls = []
+    run_in_parallel(calls.append, range(10))
+    assert sorted(calls) == list(range(10))
+
+
+def test_run_in_parallel_fail_fast(monkeypatch):
+    monkeypatch.setitem(Config(), 'ssh-parallelism', 1)
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        if item == 0:
+            return 7
+        time.sleep(0.01)
+        return 0
+
+    assert run_in_parallel(func, range(50), fail_fast=True) == 7
+    assert len(calls) < 50
+
+    calls.clear()
+    assert run_in_parallel(func, range(50)) == 7
+    assert len(calls) == 50
@@ -54,6 +54,12 @@ def test_curl_ping():
     assert res['min'] < res['median'] < res['max']
 
 
+def test_resolve_host():
+    assert resolve_host('127.0.0.1') == '127.0.0.1'
+    assert resolve_host('localhost') == resolve_host('localhost')
+    assert resolve_host.cache_info().hits > 0
+
+
 def test_extract_json():
     json_str = """some random output to throw out
     more garbage
@@ -78,6 +84,20 @@ def test_extract_json():
     assert obj1['cars'] == ['Ford', 'BMW', 'Fiat']
 
 
+def test_iter_json():
+    objs = iter_json('garbage {"a": {"b": 1}} {not json} more {"c": "}"} {"d": 4')
+    assert next(objs) == {'a': {'b': 1}}
+    assert next(objs) == {'c': '}'}
+    assert next(objs, None) is None
+    assert extract_json('no json here') is None
+
+
+def test_iter_json_skips_malformed_objects():
+    # nested objects of something which failed to parse must not be returned
+    assert list(iter_json('{"x": 1, bad {"inner": 2}} tail {"ok": true}')) == [{'ok': True}]
+    assert list(iter_json('{"a": 1} {"unclosed": {"b": 2}')) == [{'a': 1}]
+
+
 def test_group_lines_by_hanging_indent_tree():
     expected = {
         'Parent1': {
@@ -117,6 +137,7 @@ def test_find_string_in_grouping():
     assert find_string_in_grouping(groups, 'String without children') == [1]
     assert find_string_in_grouping(groups, 'I am a child of a child') == [0, 2, 1]
     assert find_string_in_grouping(groups, 'Hello world') is None
+    assert find_string_in_grouping(groups, re.compile(r'child of a \w+')) == [0, 2, 1]
 
 
 def test_parse_direction():